@@ -7,13 +7,16 @@ import os
 from dotenv import load_dotenv
 import json
 from datetime import datetime, timedelta
-import io
-from contextlib import redirect_stdout
 import re
 import asyncio
 import random
+import heapq
+import time
+from collections import Counter, deque
 import aiohttp
+from cachetools import LRUCache, TTLCache
 from io import BytesIO
+from urllib.parse import urlparse
 from analytics import Analytics
 import pandas as pd
 
@@ -28,12 +31,40 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 intents.presences = True  # Enable presence intent
-bot = commands.Bot(command_prefix='!', intents=intents)
+
+
+class EngagementBot(commands.Bot):
+    async def setup_hook(self):
+        global CHECK_WAKEUP, RESPONSE_QUEUE
+        # Created on the bot's running loop; before Python 3.10 these bind to the
+        # loop current at construction, which isn't this one at import time
+        CHECK_WAKEUP = asyncio.Event()
+        RESPONSE_QUEUE = asyncio.Queue(maxsize=RESPONSE_QUEUE_SIZE)
+    
+    async def close(self):
+        # Write out pending analytics and release pooled HTTP connections before shutting down
+        analytics.flush()
+        if HTTP_SESSION is not None and not HTTP_SESSION.closed:
+            await HTTP_SESSION.close()
+        await super().close()
+
+bot = EngagementBot(command_prefix='!', intents=intents)
 
 # Bot configuration
 BOT_NAME = "Grey"
+_BOT_NAME_LOWER = BOT_NAME.lower()
 COMMAND_PREFIX = "!"
 PEXELS_API_KEY = os.getenv("PEXELS_API_KEY")
+PEXELS_SEARCH_URL = "https://api.pexels.com/v1/search"
+HOTLINK_HOSTS = {'images.pexels.com'}  # Image hosts Discord can embed directly
+PEXELS_MAX_RETRIES = 2  # Retries after a 429 rate-limit response
+PEXELS_MAX_RETRY_DELAY = 30  # Longest wait in seconds before retrying
+
+# Shared HTTP session so Pexels requests reuse pooled keep-alive connections
+HTTP_SESSION = None
+
+# Recent Pexels search results, keyed on the normalised query
+PEXELS_CACHE = TTLCache(maxsize=512, ttl=3600)
 
 # Create engagement agent
 agent = Agent(
@@ -91,161 +122,312 @@ agent = Agent(
     markdown=True
 )
 
-# Store conversation history and message tracking
-CONVERSATION_HISTORY = {}
-UNANSWERED_MESSAGES = {}
+# Instructions sent with the current message; kept constant so prompts share a prefix
+IMMEDIATE_INSTRUCTIONS = """Please provide a response that is:
+1. Short and concise (1-2 sentences)
+2. Directly addresses the question, help request, or mention
+3. Friendly and helpful
+4. Uses appropriate emojis
+
+If you need to search for information:
+- Use natural language for your search query
+- Don't use function call syntax
+- Keep the search focused and specific
+
+Keep your response brief and to the point."""
+
+UNANSWERED_INSTRUCTIONS = """This message hasn't received a response. Please provide a brief, engaging response that:
+1. Acknowledges the message gently
+2. Encourages discussion
+3. Keeps the conversation going
+
+Keep your response short and friendly."""
+
+# Conversation and message tracking limits
 MAX_HISTORY_LENGTH = 10
+MAX_TRACKED_CHANNELS = 512
+MAX_UNANSWERED_MESSAGES = 2000
 HISTORY_EXPIRY = timedelta(hours=24)
+HISTORY_SWEEP_INTERVAL = 600  # Seconds between expired history sweeps
 DISCORD_MAX_LENGTH = 1900
 RESPONSE_DELAY = 60  # 1 minute delay before responding to unanswered messages
+MIN_RESPONSE_LENGTH = 5  # Shorter messages never trigger an LLM call
+RESPONSE_WORKERS = 4  # Concurrent LLM calls for immediate responses
+RESPONSE_QUEUE_SIZE = 64
+ANALYTICS_FLUSH_INTERVAL = 2  # Seconds between writes of queued analytics
+ANALYTICS_OPTIMIZE_INTERVAL = 900  # Seconds between query planner statistics refreshes
+
+# Store conversation history and message tracking. Both are bounded so a busy
+# server can't grow them forever; unanswered entries expire on their own and
+# only keep (channel_id, content) rather than the Message.
+CONVERSATION_HISTORY = LRUCache(maxsize=MAX_TRACKED_CHANNELS)
+UNANSWERED_MESSAGES = TTLCache(maxsize=MAX_UNANSWERED_MESSAGES, ttl=RESPONSE_DELAY * 2)
+# Channels the bot replied in recently; follow-ups there aren't chased later
+RECENTLY_ANSWERED = TTLCache(maxsize=MAX_TRACKED_CHANNELS, ttl=RESPONSE_DELAY)
+# Last history converted to chat messages per channel, keyed on (length, newest timestamp, excluded id)
+HISTORY_MESSAGES = LRUCache(maxsize=MAX_TRACKED_CHANNELS)
+
+# Heap of (due_time, message_id) unanswered checks, drained by one scheduler task
+PENDING_CHECKS = []
+CHECK_WAKEUP = None  # asyncio.Event, created in setup_hook
+SCHEDULER_TASK = None
+
+# Immediate responses waiting for a worker, as (channel, prompt)
+RESPONSE_QUEUE = None  # asyncio.Queue, created in setup_hook
+RESPONSE_WORKER_TASKS = []
+
+DAILY_STATS_TASK = None
+HISTORY_EXPIRY_TASK = None
+ANALYTICS_WRITER_TASK = None
+ANALYTICS_OPTIMIZE_TASK = None
+
+# Per-guild member counts by status, kept current from gateway events
+STATUS_COUNTS = {}
+
+# Patterns used by clean_message, compiled once at import
+_CODEBLOCK_RE = re.compile(r'```.*?```', re.DOTALL)
+_INLINE_CODE_RE = re.compile(r'`.*?`')
+_MD_RE = re.compile(r'[|*_~>]')
+_BLANKS_RE = re.compile(r'\n\s*\n')
+_NONPRINT_RE = re.compile(r'[^\w\s.,!?₹$€£¥@%&*()\-+=:;<>/\\|\[\]{}]')
+# ASCII characters _NONPRINT_RE removes, for the str.translate fast path
+_NONPRINT_ASCII_TABLE = {i: None for i in range(128) if _NONPRINT_RE.match(chr(i))}
+
+# Keywords that make a message worth answering right away, matched in one pass
+_QUESTION_RE = re.compile(
+    r'\b(?:what|how|why|when|where|who|help|please|can you|could you)\b', re.IGNORECASE
+)
+_HELP_RE = re.compile(
+    r'\b(?:help|assist|support|trouble|issue|problem|how to|guide|tutorial)\b', re.IGNORECASE
+)
 
 
 def is_question(text):
     """Check if the message is a question"""
-    question_indicators = ['?', 'what', 'how', 'why', 'when', 'where', 'who', 'can you', 'could you', 'help', 'please']
-    text_lower = text.lower()
-    return any(indicator in text_lower for indicator in question_indicators)
+    return '?' in text or _QUESTION_RE.search(text) is not None
 
 def is_help_request(text):
     """Check if the message is asking for help"""
-    help_indicators = ['help', 'assist', 'support', 'trouble', 'issue', 'problem', 'how to', 'guide', 'tutorial']
-    text_lower = text.lower()
-    return any(indicator in text_lower for indicator in help_indicators)
+    return _HELP_RE.search(text) is not None
 
 def is_bot_mentioned(message):
     """Check if the bot is mentioned by name or tag"""
-    # Check for mentions
-    if any(mention.id == bot.user.id for mention in message.mentions):
+    # Check for mentions using the raw ids from the payload
+    if bot.user.id in message.raw_mentions:
         return True
     
     # Check for name mentions (case insensitive)
-    text_lower = message.content.lower()
-    return BOT_NAME.lower() in text_lower
-
-def extract_response(text):
-    """Extract the actual response message after 'Response'"""
-    response_match = re.search(r'Response.*?\n(.*)', text, re.DOTALL)
-    if response_match:
-        return response_match.group(1).strip()
-    return text.strip()
+    return _BOT_NAME_LOWER in message.content.lower()
 
 def clean_message(text):
     """Clean up message formatting and remove unnecessary symbols"""
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    text = ansi_escape.sub('', text)
-    text = re.sub(r'```.*?```', '', text, flags=re.DOTALL)
-    text = re.sub(r'`.*?`', '', text)
-    text = re.sub(r'[|*_~>]', '', text)
-    text = re.sub(r'\n\s*\n', '\n\n', text)
+    text = _CODEBLOCK_RE.sub('', text)
+    text = _INLINE_CODE_RE.sub('', text)
+    text = _MD_RE.sub('', text)
+    text = _BLANKS_RE.sub('\n\n', text)
     text = text.strip()
-    text = re.sub(r'[^\w\s.,!?₹$€£¥@%&*()\-+=:;<>/\\|\[\]{}]', '', text)
+    if text.isascii():
+        text = text.translate(_NONPRINT_ASCII_TABLE)
+    else:
+        text = _NONPRINT_RE.sub('', text)
     text = ' '.join(text.split())
     return text
 
+async def get_agent_response(prompt):
+    """Run the agent on a prompt or message list and return its cleaned reply"""
+    response = await agent.arun(prompt)
+    return clean_message(response.content or "")
+
 def get_channel_history(channel_id):
     """Get conversation history for a channel"""
     if channel_id not in CONVERSATION_HISTORY:
-        CONVERSATION_HISTORY[channel_id] = []
+        CONVERSATION_HISTORY[channel_id] = deque(maxlen=MAX_HISTORY_LENGTH)
     return CONVERSATION_HISTORY[channel_id]
 
-def update_channel_history(channel_id, message):
+def update_channel_history(channel_id, message_id, author, content):
     """Update conversation history for a channel"""
     history = get_channel_history(channel_id)
-    history.append({
-        'content': message,
-        'timestamp': datetime.now()
-    })
-    while len(history) > MAX_HISTORY_LENGTH:
-        history.pop(0)
+    history.append({'id': message_id, 'author': author, 'content': content, 'timestamp': datetime.now()})
+
+def _prune(history):
+    """Drop expired messages from the old end of a channel's history"""
     current_time = datetime.now()
-    CONVERSATION_HISTORY[channel_id] = [
-        msg for msg in history 
-        if current_time - msg['timestamp'] < HISTORY_EXPIRY
-    ]
+    while history and current_time - history[0]['timestamp'] >= HISTORY_EXPIRY:
+        history.popleft()
 
-def format_conversation_history(channel_id):
-    """Format conversation history for the agent"""
+def history_messages(channel_id, exclude_id=None):
+    """Conversation history for a channel as a single context message for the agent"""
     history = get_channel_history(channel_id)
+    _prune(history)
     if not history:
-        return "No previous conversation history."
-    formatted_history = "Recent conversation history:\n"
-    for msg in history:
-        formatted_history += f"- {msg['content']}\n"
-    return formatted_history
+        return []
+    # Reuse the last conversion while the history is unchanged
+    key = (len(history), history[-1]['timestamp'], exclude_id)
+    cached = HISTORY_MESSAGES.get(channel_id)
+    if cached and cached[0] == key:
+        return cached[1]
+    # The current message is sent on its own, so leave it out of the history
+    lines = [f"{msg['author']}: {msg['content']}" for msg in history if msg['id'] != exclude_id]
+    messages = []
+    if lines:
+        messages.append({'role': 'user', 'content': "Recent conversation in this channel:\n" + "\n".join(lines)})
+    HISTORY_MESSAGES[channel_id] = (key, messages)
+    return messages
+
+def build_agent_messages(channel_id, instructions, content, message_id=None):
+    """Build agent input with history first and the changing current message last"""
+    # Keeping the stable part at the front lets provider prompt caches reuse it
+    return [
+        *history_messages(channel_id, exclude_id=message_id),
+        {'role': 'user', 'content': f"{instructions}\n\nCurrent message: {content}"}
+    ]
 
 def split_message(message):
     """Split a message into chunks that fit Discord's character limit"""
     if len(message) <= DISCORD_MAX_LENGTH:
         return [message]
     chunks = []
-    current_chunk = ""
-    lines = message.split('\n')
-    for line in lines:
-        if len(current_chunk) + len(line) + 1 > DISCORD_MAX_LENGTH:
-            if current_chunk:
-                chunks.append(current_chunk)
-            current_chunk = line
+    start = 0
+    while len(message) - start > DISCORD_MAX_LENGTH:
+        limit = start + DISCORD_MAX_LENGTH
+        # Break at the last newline that fits, else the last space, else mid-word
+        cut = message.rfind('\n', start, limit + 1)
+        if cut <= start:
+            cut = message.rfind(' ', start, limit + 1)
+        if cut <= start:
+            chunks.append(message[start:limit])
+            start = limit
         else:
-            if current_chunk:
-                current_chunk += '\n'
-            current_chunk += line
-    if current_chunk:
-        chunks.append(current_chunk)
+            chunks.append(message[start:cut])
+            start = cut + 1
+    # A break right at the end of the text leaves nothing for a final chunk
+    if start < len(message):
+        chunks.append(message[start:])
     return chunks
 
-async def check_unanswered_message(channel, message):
-    """Check and respond to unanswered messages after delay"""
-    await asyncio.sleep(RESPONSE_DELAY)
-    if message.id in UNANSWERED_MESSAGES:
+async def send_response(destination, text, log_analytics=False):
+    """Send text to a channel or context using as few messages as possible"""
+    sent_messages = [await destination.send(chunk) for chunk in split_message(text)]
+    if sent_messages:
+        RECENTLY_ANSWERED[sent_messages[-1].channel.id] = True
+    if log_analytics:
+        # Log bot response to analytics (counts as a bot response)
+        for sent_message in sent_messages:
+            analytics.log_message(sent_message, is_bot=True)
+    return sent_messages
+
+async def check_unanswered_message(message_id):
+    """Check and respond to an unanswered message once its delay has passed"""
+    if message_id in UNANSWERED_MESSAGES:
+        channel_id, content = UNANSWERED_MESSAGES[message_id]
+        channel = bot.get_channel(channel_id)
+        if channel is None:
+            UNANSWERED_MESSAGES.pop(message_id, None)
+            return
+        
         # Check if message still needs a response
-        async for msg in channel.history(limit=10, after=message):
+        async for msg in channel.history(limit=10, after=discord.Object(id=message_id)):
             if msg.author != bot.user and not msg.author.bot:
                 # Someone else responded, remove from tracking
-                UNANSWERED_MESSAGES.pop(message.id, None)
+                UNANSWERED_MESSAGES.pop(message_id, None)
                 return
         
         # No response received, send a gentle engagement message
-        prompt = f"""Context: {format_conversation_history(channel.id)}
+        prompt = build_agent_messages(channel.id, UNANSWERED_INSTRUCTIONS, content, message_id)
         
-        Current message: {message.content}
+        cleaned_response = await get_agent_response(prompt)
         
-        This message hasn't received a response. Please provide a brief, engaging response that:
-        1. Acknowledges the message gently
-        2. Encourages discussion
-        3. Keeps the conversation going
+        await send_response(channel, cleaned_response, log_analytics=True)
         
-        Keep your response short and friendly."""
+        UNANSWERED_MESSAGES.pop(message_id, None)
+
+def schedule_unanswered_check(message):
+    """Queue a delayed check for a message that didn't get an immediate response"""
+    UNANSWERED_MESSAGES[message.id] = (message.channel.id, message.content)
+    heapq.heappush(PENDING_CHECKS, (time.monotonic() + RESPONSE_DELAY, message.id))
+    CHECK_WAKEUP.set()
+
+async def unanswered_message_scheduler():
+    """Single task that dispatches unanswered message checks as they come due"""
+    while not bot.is_closed():
+        if not PENDING_CHECKS:
+            await CHECK_WAKEUP.wait()
+            CHECK_WAKEUP.clear()
+            continue
         
-        f = io.StringIO()
-        with redirect_stdout(f):
-            agent.print_response(prompt)
-        response = f.getvalue()
-        actual_response = extract_response(response)
-        cleaned_response = clean_message(actual_response)
+        due, message_id = PENDING_CHECKS[0]
+        delay = due - time.monotonic()
+        if delay > 0:
+            # Sleep until the earliest check is due, or until a new one is queued
+            try:
+                await asyncio.wait_for(CHECK_WAKEUP.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            CHECK_WAKEUP.clear()
+            continue
         
-        chunks = split_message(cleaned_response)
-        for chunk in chunks:
-            sent_message = await channel.send(chunk)
-            # Log bot response to analytics (counts as a bot response)
-            analytics.log_message(sent_message, is_bot=True)
-        
-        UNANSWERED_MESSAGES.pop(message.id, None)
+        heapq.heappop(PENDING_CHECKS)
+        bot.loop.create_task(check_unanswered_message(message_id))
+
+async def response_worker():
+    """Worker that generates and sends queued immediate responses"""
+    while not bot.is_closed():
+        channel, prompt = await RESPONSE_QUEUE.get()
+        try:
+            cleaned_response = await get_agent_response(prompt)
+            await send_response(channel, cleaned_response, log_analytics=True)
+        except Exception as e:
+            print(f"Error sending response: {e}")
+        finally:
+            RESPONSE_QUEUE.task_done()
+
+def get_http_session():
+    """Return the shared HTTP session, creating it if needed"""
+    global HTTP_SESSION
+    if HTTP_SESSION is None or HTTP_SESSION.closed:
+        HTTP_SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=75)
+        )
+    return HTTP_SESSION
+
+def _pexels_retry_delay(headers, attempt):
+    """Seconds to wait before retrying a rate-limited Pexels request"""
+    try:
+        delay = int(headers.get('X-Ratelimit-Reset')) - time.time()
+    except (TypeError, ValueError):
+        # No usable reset time, fall back to exponential backoff
+        delay = 2 ** attempt
+    return min(max(delay, 0), PEXELS_MAX_RETRY_DELAY)
 
 async def get_pexels_image(query):
     """Get an image from Pexels API"""
+    # Popular searches are served from the cache without touching the API
+    key = query.strip().lower()
+    if key in PEXELS_CACHE:
+        return PEXELS_CACHE[key]
+    
     try:
         headers = {
             'Authorization': PEXELS_API_KEY
         }
-        search_url = f"https://api.pexels.com/v1/search?query={query}&per_page=1"
+        params = {'query': query, 'per_page': 1}
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(search_url, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data['photos']:
-                        return data['photos'][0]['src']['large']
-                print(f"Pexels API error: {response.status}")
+        for attempt in range(PEXELS_MAX_RETRIES + 1):
+            async with get_http_session().get(PEXELS_SEARCH_URL, params=params, headers=headers) as response:
+                if response.status != 429 or attempt == PEXELS_MAX_RETRIES:
+                    if response.status == 200:
+                        data = await response.json()
+                        if data['photos']:
+                            image_url = data['photos'][0]['src']['large']
+                            PEXELS_CACHE[key] = image_url
+                            return image_url
+                    print(f"Pexels API error: {response.status}")
+                    return None
+                retry_delay = _pexels_retry_delay(response.headers, attempt)
+            
+            # Rate limited: wait for the quota to reset before trying again
+            print(f"Pexels rate limit hit, retrying in {retry_delay:.0f}s")
+            await asyncio.sleep(retry_delay)
     except Exception as e:
         print(f"Error fetching from Pexels: {str(e)}")
     return None
@@ -253,18 +435,17 @@ async def get_pexels_image(query):
 async def send_image(ctx, image_url, caption=None):
     """Send an image to the channel"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(image_url) as response:
-                if response.status == 200:
-                    image_data = await response.read()
-                    image_io = BytesIO(image_data)
-                    
-                    if caption:
-                        await ctx.send(caption, file=discord.File(image_io, "image.jpg"))
-                    else:
-                        await ctx.send(file=discord.File(image_io, "image.jpg"))
+        async with get_http_session().get(image_url) as response:
+            if response.status == 200:
+                image_data = await response.read()
+                image_io = BytesIO(image_data)
+                
+                if caption:
+                    await ctx.send(caption, file=discord.File(image_io, "image.jpg"))
                 else:
-                    await ctx.send("Sorry, I couldn't download the image. Please try again. 😕")
+                    await ctx.send(file=discord.File(image_io, "image.jpg"))
+            else:
+                await ctx.send("Sorry, I couldn't download the image. Please try again. 😕")
     except Exception as e:
         await ctx.send(f"Sorry, there was an error sending the image: {str(e)}")
 
@@ -286,9 +467,12 @@ async def image_command(ctx, *, query):
             await searching_msg.edit(content="Sorry, I couldn't find any images. Please try a different search term. 😕")
             return
             
-        # Send the image
-        await searching_msg.edit(content=f"Here's an image for '{query}':")
-        await send_image(ctx, image_url)
+        # Link the image so Discord embeds it; only re-upload from hosts that block hotlinking
+        if urlparse(image_url).hostname in HOTLINK_HOSTS:
+            await searching_msg.edit(content=f"Here's an image for '{query}':\n{image_url}")
+        else:
+            await searching_msg.edit(content=f"Here's an image for '{query}':")
+            await send_image(ctx, image_url)
         
     except Exception as e:
         await ctx.send(f"Sorry, there was an error: {str(e)}")
@@ -325,7 +509,7 @@ async def ping_command(ctx):
 async def clear_command(ctx):
     """Clear conversation history for the current channel"""
     if ctx.channel.id in CONVERSATION_HISTORY:
-        CONVERSATION_HISTORY[ctx.channel.id] = []
+        CONVERSATION_HISTORY[ctx.channel.id].clear()
     await ctx.send("Conversation history cleared! 🧹")
 
 @bot.command(name='stats')
@@ -351,16 +535,9 @@ async def search_command(ctx, *, query):
     Provide a brief, informative response with the most relevant information.
     Keep it concise and focused on the key points."""
     
-    f = io.StringIO()
-    with redirect_stdout(f):
-        agent.print_response(prompt)
-    response = f.getvalue()
-    actual_response = extract_response(response)
-    cleaned_response = clean_message(actual_response)
+    cleaned_response = await get_agent_response(prompt)
     
-    chunks = split_message(cleaned_response)
-    for chunk in chunks:
-        await ctx.send(chunk)
+    await send_response(ctx, cleaned_response)
 
 @bot.command(name='members')
 async def members_command(ctx):
@@ -368,21 +545,14 @@ async def members_command(ctx):
     guild = ctx.guild
     total_members = guild.member_count
     
-    # Count members by status
-    online = 0
-    idle = 0
-    dnd = 0
-    offline = 0
-    
-    for member in guild.members:
-        if member.status == discord.Status.online:
-            online += 1
-        elif member.status == discord.Status.idle:
-            idle += 1
-        elif member.status == discord.Status.dnd:
-            dnd += 1
-        else:
-            offline += 1
+    # Read status counts maintained by the presence/member events
+    if guild.id not in STATUS_COUNTS:
+        count_member_statuses(guild)
+    counts = STATUS_COUNTS[guild.id]
+    online = counts[discord.Status.online]
+    idle = counts[discord.Status.idle]
+    dnd = counts[discord.Status.dnd]
+    offline = counts[discord.Status.offline]
     
     member_stats = f"""**Server Member Statistics:**
     
@@ -394,18 +564,70 @@ async def members_command(ctx):
     
     await ctx.send(member_stats)
 
+def _status_bucket(status):
+    """Map a member status onto the buckets shown by !members"""
+    if status in (discord.Status.online, discord.Status.idle, discord.Status.dnd):
+        return status
+    return discord.Status.offline
+
+def count_member_statuses(guild):
+    """Rebuild a guild's status counts with one pass over its members"""
+    STATUS_COUNTS[guild.id] = Counter(_status_bucket(member.status) for member in guild.members)
+
+@bot.event
+async def on_presence_update(before, after):
+    # Guilds that haven't been counted yet get a full count on first use
+    counts = STATUS_COUNTS.get(after.guild.id)
+    if counts is not None and before.status != after.status:
+        counts[_status_bucket(before.status)] -= 1
+        counts[_status_bucket(after.status)] += 1
+
+@bot.event
+async def on_member_join(member):
+    counts = STATUS_COUNTS.get(member.guild.id)
+    if counts is not None:
+        counts[_status_bucket(member.status)] += 1
+
+@bot.event
+async def on_member_remove(member):
+    counts = STATUS_COUNTS.get(member.guild.id)
+    if counts is not None:
+        counts[_status_bucket(member.status)] -= 1
+
+@bot.event
+async def on_guild_join(guild):
+    count_member_statuses(guild)
+
 @bot.event
 async def on_ready():
+    global SCHEDULER_TASK, DAILY_STATS_TASK, HISTORY_EXPIRY_TASK, ANALYTICS_WRITER_TASK, ANALYTICS_OPTIMIZE_TASK
     print(f'Bot is ready! Logged in as {bot.user.name}')
-    # Set bot's nickname to Grey
+    get_http_session()
+    # Set bot's nickname to Grey and prime member status counts
     for guild in bot.guilds:
+        count_member_statuses(guild)
         try:
             await guild.me.edit(nick=BOT_NAME)
         except:
             pass
     
-    # Start the daily stats update task
-    bot.loop.create_task(update_daily_stats_task())
+    # Start the daily stats update, history expiry and analytics maintenance tasks
+    if DAILY_STATS_TASK is None or DAILY_STATS_TASK.done():
+        DAILY_STATS_TASK = bot.loop.create_task(update_daily_stats_task())
+    if HISTORY_EXPIRY_TASK is None or HISTORY_EXPIRY_TASK.done():
+        HISTORY_EXPIRY_TASK = bot.loop.create_task(expire_history_task())
+    if ANALYTICS_WRITER_TASK is None or ANALYTICS_WRITER_TASK.done():
+        ANALYTICS_WRITER_TASK = bot.loop.create_task(analytics_writer_task())
+    if ANALYTICS_OPTIMIZE_TASK is None or ANALYTICS_OPTIMIZE_TASK.done():
+        ANALYTICS_OPTIMIZE_TASK = bot.loop.create_task(analytics_optimize_task())
+    
+    # Start the unanswered message scheduler and response workers once, even across reconnects
+    if SCHEDULER_TASK is None or SCHEDULER_TASK.done():
+        SCHEDULER_TASK = bot.loop.create_task(unanswered_message_scheduler())
+    if not RESPONSE_WORKER_TASKS:
+        RESPONSE_WORKER_TASKS.extend(
+            bot.loop.create_task(response_worker()) for _ in range(RESPONSE_WORKERS)
+        )
 
 @bot.event
 async def on_message(message):
@@ -426,7 +648,7 @@ async def on_message(message):
         analytics.mark_message_as_replied(message.reference.message_id)
     
     # Update conversation history
-    update_channel_history(message.channel.id, message.content)
+    update_channel_history(message.channel.id, message.id, message.author.display_name, message.content)
     
     # Check if message needs immediate response
     needs_response = (
@@ -435,41 +657,25 @@ async def on_message(message):
         is_bot_mentioned(message)
     )
     
+    # Skip the LLM for noise like "ok", "lol" or emoji-only messages, unless
+    # the bot was addressed directly or asked something
+    content = message.content.strip()
+    if not needs_response and (len(content) < MIN_RESPONSE_LENGTH or
+                               not any(ch.isalnum() for ch in content)):
+        return
+    
     if needs_response:
         # Immediate response for questions, help requests, or mentions
-        prompt = f"""Context: {format_conversation_history(message.channel.id)}
-        
-        Current message: {message.content}
+        prompt = build_agent_messages(message.channel.id, IMMEDIATE_INSTRUCTIONS, message.content, message.id)
         
-        Please provide a response that is:
-        1. Short and concise (1-2 sentences)
-        2. Directly addresses the question, help request, or mention
-        3. Friendly and helpful
-        4. Uses appropriate emojis
-        
-        If you need to search for information:
-        - Use natural language for your search query
-        - Don't use function call syntax
-        - Keep the search focused and specific
-        
-        Keep your response brief and to the point."""
-        
-        f = io.StringIO()
-        with redirect_stdout(f):
-            agent.print_response(prompt)
-        response = f.getvalue()
-        actual_response = extract_response(response)
-        cleaned_response = clean_message(actual_response)
-        
-        chunks = split_message(cleaned_response)
-        for chunk in chunks:
-            sent_message = await message.channel.send(chunk)
-            # Log bot response to analytics (counts as a bot response)
-            analytics.log_message(sent_message, is_bot=True)
-    else:
-        # Track message for potential later response
-        UNANSWERED_MESSAGES[message.id] = message
-        bot.loop.create_task(check_unanswered_message(message.channel, message))
+        # Hand the LLM call and send to the response workers
+        try:
+            RESPONSE_QUEUE.put_nowait((message.channel, prompt))
+        except asyncio.QueueFull:
+            print(f"Response queue full, dropping message {message.id}")
+    elif message.channel.id not in RECENTLY_ANSWERED:
+        # Track message for potential later response, unless the bot just spoke here
+        schedule_unanswered_check(message)
 
 @bot.command(name='analytics')
 async def analytics_command(ctx):
@@ -478,22 +684,25 @@ async def analytics_command(ctx):
         # Update stats
         analytics.update_hourly_stats()
         
-        # Get latest stats
-        latest_stats = analytics.get_hourly_stats(hours=24).iloc[-1]
+        # Fetch the last 24 hours once and work on plain arrays
+        trends = analytics.get_hourly_stats(hours=24)
+        hours = trends['hour']
+        message_counts = trends['total_messages'].to_numpy()
+        user_counts = trends['unique_users'].to_numpy()
+        response_counts = trends['bot_responses'].to_numpy()
         
-        # Calculate additional metrics
-        total_messages = int(float(latest_stats['total_messages']))
-        unique_users = int(float(latest_stats['unique_users']))
-        bot_responses = int(float(latest_stats['bot_responses']))
+        # Calculate additional metrics for the latest hour
+        total_messages = int(message_counts[-1])
+        unique_users = int(user_counts[-1])
+        bot_responses = int(response_counts[-1])
         
         avg_messages = total_messages / unique_users if unique_users > 0 else 0
         response_ratio = bot_responses / total_messages if total_messages > 0 else 0
         
         # Get trends
-        trends = analytics.get_hourly_stats(hours=24)
-        most_active_hour = trends.loc[trends['total_messages'].idxmax()]
-        peak_users = trends['unique_users'].max()
-        best_response_hour = trends.loc[trends['bot_responses'].idxmax()]
+        most_active_idx = message_counts.argmax()
+        best_response_idx = response_counts.argmax()
+        peak_users = user_counts.max()
         
         # Format the output
         stats_text = f"""📊 **Analytics Overview (Last 24 Hours)**
@@ -506,12 +715,12 @@ async def analytics_command(ctx):
 • Bot Response Ratio: {response_ratio:.1%}
 
 **Trends (Last 24 Hours):**
-• Most Active Hour: {most_active_hour['hour'].strftime('%H:%M')} ({int(most_active_hour['total_messages'])} messages)
+• Most Active Hour: {hours.iat[most_active_idx].strftime('%H:%M')} ({int(message_counts[most_active_idx])} messages)
 • Peak Users: {int(peak_users)}
-• Best Response Hour: {best_response_hour['hour'].strftime('%H:%M')} ({int(best_response_hour['bot_responses'])} responses)"""
+• Best Response Hour: {hours.iat[best_response_idx].strftime('%H:%M')} ({int(response_counts[best_response_idx])} responses)"""
         
         # Generate and send plot
-        plot_path = analytics.generate_engagement_plot(hours=24)
+        plot_path = analytics.generate_engagement_plot(hours=24, stats=trends)
         if plot_path and plot_path.exists():
             await ctx.send(stats_text, file=discord.File(str(plot_path)))
         else:
@@ -531,6 +740,31 @@ async def update_daily_stats_task():
             print(f"Error updating hourly stats: {e}")
         await asyncio.sleep(3600)  # Update every hour
 
+async def expire_history_task():
+    """Task to drop expired conversation history"""
+    await bot.wait_until_ready()
+    while not bot.is_closed():
+        for channel_id, history in list(CONVERSATION_HISTORY.items()):
+            _prune(history)
+            if not history:
+                # Whole channel has gone quiet, forget it
+                CONVERSATION_HISTORY.pop(channel_id, None)
+        await asyncio.sleep(HISTORY_SWEEP_INTERVAL)
+
+async def analytics_writer_task():
+    """Task to write queued analytics in batches off the message path"""
+    await bot.wait_until_ready()
+    while not bot.is_closed():
+        await asyncio.sleep(ANALYTICS_FLUSH_INTERVAL)
+        await asyncio.to_thread(analytics.flush)
+
+async def analytics_optimize_task():
+    """Task to keep the analytics database's query planner statistics fresh"""
+    await bot.wait_until_ready()
+    while not bot.is_closed():
+        await asyncio.sleep(ANALYTICS_OPTIMIZE_INTERVAL)
+        await asyncio.to_thread(analytics.optimize)
+
 # Run the bot
 if __name__ == "__main__":
     bot.run(os.getenv("DISCORD_TOKEN")) 
@@ -1,17 +1,114 @@
+import atexit
 import sqlite3
-from datetime import datetime, timedelta
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
 import pandas as pd
+import matplotlib
+# Plots are only ever saved to files, so skip loading a GUI toolkit
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import seaborn as sns
 from pathlib import Path
 import json
-import pytz
+
+IST_OFFSET_SECONDS = 19800  # IST is UTC+05:30 with no DST
+ROLLUP_HOURS = 48  # Hours of activity kept in the in-memory rollup
+STATS_CHUNKED_HOURS = 168  # Longer hourly stats windows are read in chunks
+STATS_CHUNKSIZE = 1000
+SQL_VARIABLE_LIMIT = 500  # Ids per IN (...) lookup, under SQLite's bound parameter limit
+PLOT_DPI = 120  # Discord shows images at around 100 dpi
+
+# Column types of the hourly stats frame, applied once after the read
+_HOURLY_STATS_DTYPES = {
+    'hour': 'int64',
+    'total_messages': 'int64',
+    'unique_users': 'int64',
+    'bot_responses': 'int64',
+    'response_rate': 'float64'
+}
+
+# Columns of the messages table, shared by its creation and migration
+_MESSAGES_COLUMNS = '''(id INTEGER PRIMARY KEY,
+                        channel_id TEXT,
+                        author_id TEXT,
+                        content TEXT,
+                        timestamp INTEGER NOT NULL,
+                        is_bot INTEGER,
+                        is_reply INTEGER,
+                        reply_to_id INTEGER)'''
+
+# Statements run on every flush or stats update, kept as constants so the
+# connection's statement cache always gets the same key for them
+_INSERT_MSG_SQL = '''INSERT OR IGNORE INTO messages 
+                    (id, channel_id, author_id, content, timestamp, is_bot, is_reply, reply_to_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''
+
+# Replies are appended to their own table rather than updating the message row
+_MARK_REPLY_SQL = '''INSERT OR IGNORE INTO message_replies (message_id)
+                    SELECT id FROM messages WHERE id = ?'''
+
+_REPLIED_MSG_SQL = 'SELECT timestamp, is_bot FROM messages WHERE id = ?'
+
+# Message and bot response counts are kept current by the insert trigger,
+# so only the stats that need the whole hour are computed here
+_HOURLY_SQL = '''
+SELECT 
+    CAST(COUNT(DISTINCT author_id) AS INTEGER) as unique_users,
+    CAST(SUM(is_bot * (r.message_id IS NOT NULL)) * 1.0 / NULLIF(SUM(is_bot), 0) AS REAL) as response_rate
+FROM messages
+LEFT JOIN message_replies r ON r.message_id = messages.id
+WHERE timestamp >= ?
+AND timestamp < ?
+'''
+
+_UPSERT_HOURLY_SQL = '''INSERT INTO hourly_stats
+                        (hour, total_messages, unique_users, bot_responses, response_rate)
+                        VALUES (?, 0, ?, 0, ?)
+                        ON CONFLICT(hour) DO UPDATE SET
+                            unique_users = excluded.unique_users,
+                            response_rate = excluded.response_rate'''
+
+# Columns of the rollup counters
+_MESSAGES, _BOT_RESPONSES, _REPLIED_RESPONSES = range(3)
 
 class Analytics:
     def __init__(self, db_path="analytics.db"):
         self.db_path = db_path
-        self.ist = pytz.timezone('Asia/Kolkata')
+        # IST has no daylight saving, so a fixed offset is exact
+        self.ist = timezone(timedelta(seconds=IST_OFFSET_SECONDS))
+        
+        # Hourly counters for recent activity, one row per IST hour in a ring
+        # indexed by hour % ROLLUP_HOURS, so recent stats never need a query
+        self._hour_buckets = np.zeros((ROLLUP_HOURS, 3), dtype=np.int64)
+        self._bucket_hours = np.full(ROLLUP_HOURS, -1, dtype=np.int64)
+        self._bucket_users = [set() for _ in range(ROLLUP_HOURS)]
+        self._rollup_lock = threading.Lock()
+        
+        # One figure is redrawn for every plot instead of allocating a new one
+        self._fig, (self._ax1, self._ax2) = plt.subplots(2, 1, figsize=(12, 10))
+        self._fig.suptitle('Community Engagement Overview (Last 24 Hours - IST)', fontsize=16, y=0.95)
+        self._plot_lock = threading.Lock()
+        
+        # Rendered plots keyed by (hours, IST hour, data version); the version is
+        # bumped on every flush, so a cached plot is only reused while nothing changed
+        self._data_version = 0
+        self._plot_cache = {}
+        
+        # One long-lived connection keeps SQLite's page cache warm between calls
+        self._conn = self._connect()
+        self._lock = threading.Lock()
+        atexit.register(self._conn.close)
+        
+        # Writes queued by log_message and mark_message_as_replied until the next flush
+        self._pending_messages = []
+        self._pending_replies = []
+        self._pending_lock = threading.Lock()
+        atexit.register(self.flush)
+        
         self._init_db()
+        self._load_rollup()
     
     def _get_ist_time(self):
         """Get current time in IST"""
@@ -20,259 +117,454 @@ class Analytics:
     def _format_ist_time(self, dt):
         """Format datetime to IST string"""
         if dt.tzinfo is None:
-            dt = self.ist.localize(dt)
+            dt = dt.replace(tzinfo=self.ist)
         return dt.strftime('%Y-%m-%d %H:00:00')
     
+    def _epoch_hour(self, timestamp):
+        """Absolute IST hour number for a unix timestamp"""
+        return int(timestamp + IST_OFFSET_SECONDS) // 3600
+    
+    def _rollup_slot(self, hour):
+        """Rollup row for an IST hour, recycling the row if it holds an older hour"""
+        slot = hour % ROLLUP_HOURS
+        if self._bucket_hours[slot] != hour:
+            if self._bucket_hours[slot] > hour:
+                # Older than anything the rollup still covers
+                return None
+            self._hour_buckets[slot] = 0
+            self._bucket_hours[slot] = hour
+            self._bucket_users[slot] = set()
+        return slot
+    
+    def _record_rollup(self, timestamp, author_id, is_bot, has_reply=False):
+        """Count one message in the in-memory rollup"""
+        with self._rollup_lock:
+            slot = self._rollup_slot(self._epoch_hour(timestamp))
+            if slot is None:
+                return
+            self._hour_buckets[slot, _MESSAGES] += 1
+            self._bucket_users[slot].add(author_id)
+            if is_bot:
+                self._hour_buckets[slot, _BOT_RESPONSES] += 1
+                if has_reply:
+                    self._hour_buckets[slot, _REPLIED_RESPONSES] += 1
+    
+    def _mark_rollup_replied(self, timestamp):
+        """Count a newly replied bot response in the rollup"""
+        with self._rollup_lock:
+            hour = self._epoch_hour(timestamp)
+            slot = hour % ROLLUP_HOURS
+            if self._bucket_hours[slot] == hour:
+                self._hour_buckets[slot, _REPLIED_RESPONSES] += 1
+    
+    def _load_rollup(self):
+        """Fill the rollup from messages already in the database"""
+        try:
+            cutoff = int(time.time()) - ROLLUP_HOURS * 3600
+            with self._lock:
+                rows = self._conn.execute('''SELECT timestamp, author_id, is_bot,
+                                                    r.message_id IS NOT NULL as has_reply
+                                             FROM messages
+                                             LEFT JOIN message_replies r ON r.message_id = messages.id
+                                             WHERE timestamp >= ?''', (cutoff,)).fetchall()
+            for timestamp, author_id, is_bot, has_reply in rows:
+                self._record_rollup(timestamp, author_id, is_bot, has_reply)
+        except Exception as e:
+            print(f"Error loading analytics rollup: {e}")
+    
+    def _rollup_stats(self, hours):
+        """Hourly statistics for the last n hours, read from the rollup"""
+        current_hour = self._epoch_hour(time.time())
+        # One row for every hour in the window, so quiet hours show up as zeros
+        bucket_hours = np.arange(current_hour - hours, current_hour + 1, dtype=np.int64)
+        counts = np.zeros((len(bucket_hours), 3), dtype=np.int64)
+        unique_users = np.zeros(len(bucket_hours), dtype=np.int64)
+        with self._rollup_lock:
+            slots = np.flatnonzero((self._bucket_hours >= bucket_hours[0]) &
+                                   (self._bucket_hours <= current_hour))
+            rows = self._bucket_hours[slots] - bucket_hours[0]
+            counts[rows] = self._hour_buckets[slots]
+            unique_users[rows] = [len(self._bucket_users[slot]) for slot in slots]
+        
+        bot_responses = counts[:, _BOT_RESPONSES]
+        response_rate = np.divide(counts[:, _REPLIED_RESPONSES], bot_responses,
+                                  out=np.zeros(len(bot_responses)), where=bot_responses > 0)
+        # Hour numbers already include the IST offset, so this gives IST wall-clock hours
+        return pd.DataFrame({
+            'hour': pd.to_datetime(bucket_hours * 3600, unit='s'),
+            'total_messages': counts[:, _MESSAGES],
+            'unique_users': unique_users,
+            'bot_responses': bot_responses,
+            'response_rate': response_rate
+        })
+    
+    def _connect(self):
+        """Open the shared connection with the per-connection performance settings applied"""
+        # The batch writer runs in a worker thread, so access is serialised by self._lock
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+        try:
+            # WAL only needs an fsync at checkpoints, so NORMAL is still crash-safe
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA cache_size=-64000')
+            conn.execute('PRAGMA busy_timeout=5000')
+            # Bound the rows ANALYZE and PRAGMA optimize sample per index
+            conn.execute('PRAGMA analysis_limit=1000')
+        except Exception:
+            # Don't leak the file handle if the connection can't be set up
+            conn.close()
+            raise
+        return conn
+    
     def _init_db(self):
         """Initialize the SQLite database with required tables"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
-            
-            # Messages table
-            c.execute('''CREATE TABLE IF NOT EXISTS messages
-                        (id INTEGER PRIMARY KEY,
-                         channel_id TEXT,
-                         author_id TEXT,
-                         content TEXT,
-                         timestamp DATETIME,
-                         is_bot INTEGER,
-                         is_reply INTEGER,
-                         reply_to_id INTEGER,
-                         has_reply INTEGER DEFAULT 0)''')
-            
-            # Hourly stats table
-            c.execute('''CREATE TABLE IF NOT EXISTS hourly_stats
-                        (hour TEXT PRIMARY KEY,
-                         total_messages INTEGER,
-                         unique_users INTEGER,
-                         bot_responses INTEGER,
-                         response_rate REAL)''')
-            
-            conn.commit()
+            with self._lock, self._conn:
+                c = self._conn.cursor()
+                
+                # Write-ahead logging persists in the database file, so it is set once here
+                c.execute('PRAGMA journal_mode=WAL')
+                
+                # Messages table
+                c.execute('CREATE TABLE IF NOT EXISTS messages ' + _MESSAGES_COLUMNS)
+                
+                # Bot messages that have received a reply
+                c.execute('''CREATE TABLE IF NOT EXISTS message_replies
+                            (message_id INTEGER PRIMARY KEY) WITHOUT ROWID''')
+                
+                # Older databases declared timestamp as DATETIME and kept replies in a
+                # has_reply column; SQLite can't change a column's type in place, so
+                # move the replies over and copy the rows into a rebuilt table
+                columns = {row[1]: row[2] for row in c.execute('PRAGMA table_info(messages)')}
+                migrated = columns['timestamp'] != 'INTEGER' or 'has_reply' in columns
+                if migrated:
+                    # Timestamps are unix epoch seconds; convert rows stored as ISO strings
+                    c.execute('''UPDATE messages
+                                SET timestamp = CAST(strftime('%s', timestamp) AS INTEGER)
+                                WHERE typeof(timestamp) = 'text'
+                                ''')
+                    if 'has_reply' in columns:
+                        c.execute('''INSERT OR IGNORE INTO message_replies (message_id)
+                                    SELECT id FROM messages WHERE has_reply = 1''')
+                    c.execute('CREATE TABLE messages_new ' + _MESSAGES_COLUMNS)
+                    c.execute('''INSERT INTO messages_new
+                                SELECT id, channel_id, author_id, content, timestamp,
+                                       is_bot, is_reply, reply_to_id
+                                FROM messages
+                                WHERE timestamp IS NOT NULL''')
+                    c.execute('DROP TABLE messages')
+                    c.execute('ALTER TABLE messages_new RENAME TO messages')
+                
+                # Range scans for the time-windowed stats queries
+                c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_ts
+                            ON messages(timestamp)''')
+                # Partial index keeps the bot-only effectiveness lookups small
+                c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_bot_ts
+                            ON messages(timestamp) WHERE is_bot = 1''')
+                
+                # Hourly stats table
+                c.execute('''CREATE TABLE IF NOT EXISTS hourly_stats
+                            (hour TEXT PRIMARY KEY,
+                             total_messages INTEGER,
+                             unique_users INTEGER,
+                             bot_responses INTEGER,
+                             response_rate REAL)''')
+                
+                # The trigger only counts rows inserted after it exists, so the first time it
+                # is created (or after the messages table is rebuilt) fill in existing hours
+                has_trigger = c.execute('''SELECT 1 FROM sqlite_master
+                                           WHERE type = 'trigger' AND name = ?''',
+                                        ('trg_messages_hourly_stats',)).fetchone()
+                if not has_trigger:
+                    c.execute('''INSERT INTO hourly_stats
+                                (hour, total_messages, unique_users, bot_responses, response_rate)
+                                SELECT 
+                                    strftime('%Y-%m-%d %H:00:00', timestamp, 'unixepoch', '+5 hours', '+30 minutes') as hour,
+                                    COUNT(*),
+                                    COUNT(DISTINCT author_id),
+                                    SUM(is_bot),
+                                    COALESCE(SUM(is_bot * (r.message_id IS NOT NULL)) * 1.0 / NULLIF(SUM(is_bot), 0), 0.0)
+                                FROM messages
+                                LEFT JOIN message_replies r ON r.message_id = messages.id
+                                WHERE 1
+                                GROUP BY hour
+                                ON CONFLICT(hour) DO UPDATE SET
+                                    total_messages = excluded.total_messages,
+                                    unique_users = excluded.unique_users,
+                                    bot_responses = excluded.bot_responses,
+                                    response_rate = excluded.response_rate''')
+                
+                # Count each new message into its IST hour as it is inserted
+                c.execute('''CREATE TRIGGER IF NOT EXISTS trg_messages_hourly_stats
+                            AFTER INSERT ON messages
+                            BEGIN
+                                INSERT INTO hourly_stats
+                                (hour, total_messages, unique_users, bot_responses, response_rate)
+                                VALUES (strftime('%Y-%m-%d %H:00:00', NEW.timestamp, 'unixepoch', '+5 hours', '+30 minutes'),
+                                        1, 0, NEW.is_bot, 0.0)
+                                ON CONFLICT(hour) DO UPDATE SET
+                                    total_messages = total_messages + 1,
+                                    bot_responses = bot_responses + NEW.is_bot;
+                            END''')
+                
+                # Give the query planner statistics for the indexes after a migration;
+                # from then on the periodic PRAGMA optimize keeps them current
+                if migrated:
+                    c.execute('ANALYZE')
         except Exception as e:
             print(f"Error initializing database: {e}")
-        finally:
-            conn.close()
     
-    def log_message(self, message, is_bot=False, is_reply=False, reply_to_id=None):
-        """Log a message to the database"""
+    def optimize(self):
+        """Let SQLite refresh query planner statistics that have gone stale"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
-            
-            # Convert message timestamp to IST
-            message_time = message.created_at.astimezone(self.ist)
-            
-            c.execute('''INSERT INTO messages 
-                        (channel_id, author_id, content, timestamp, is_bot, is_reply, reply_to_id)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                     (str(message.channel.id), str(message.author.id), message.content,
-                      message_time.isoformat(), 1 if is_bot else 0, 1 if is_reply else 0, reply_to_id))
-            
-            conn.commit()
+            with self._lock:
+                self._conn.execute('PRAGMA optimize')
         except Exception as e:
-            print(f"Error logging message: {e}")
-        finally:
-            conn.close()
+            print(f"Error optimizing database: {e}")
+    
+    def _message_row(self, message, is_bot=False, is_reply=False, reply_to_id=None):
+        """Build the messages table row for a Discord message"""
+        # Rows are keyed by the Discord message id, so replies can be matched to them
+        return (message.id, str(message.channel.id), str(message.author.id), message.content,
+                int(message.created_at.timestamp()), 1 if is_bot else 0, 1 if is_reply else 0, reply_to_id)
+    
+    def log_message(self, message, is_bot=False, is_reply=False, reply_to_id=None):
+        """Queue a message to be logged on the next flush, returning its row id"""
+        self.log_batch([(message, is_bot, is_reply, reply_to_id)])
+        return message.id
+    
+    def log_batch(self, entries):
+        """Queue (message, is_bot, is_reply, reply_to_id) entries to be logged on the next flush"""
+        pending = [self._message_row(*entry) for entry in entries]
+        with self._pending_lock:
+            self._pending_messages.extend(pending)
     
     def mark_message_as_replied(self, message_id):
-        """Mark a message as having received a reply"""
+        """Queue a message to be marked as having received a reply on the next flush"""
+        with self._pending_lock:
+            self._pending_replies.append(message_id)
+    
+    def flush(self):
+        """Write queued messages and reply marks in a single transaction"""
+        with self._pending_lock:
+            messages, self._pending_messages = self._pending_messages, []
+            replies, self._pending_replies = self._pending_replies, []
+        if not messages and not replies:
+            return
+        
+        inserted = []
+        replied = []
         try:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
-            
-            c.execute('''UPDATE messages 
-                        SET has_reply = 1 
-                        WHERE id = ?''', (message_id,))
-            
-            conn.commit()
+            with self._lock, self._conn:
+                # Leave out messages that were already logged, so the rollup only
+                # counts rows that are really inserted
+                existing = set()
+                ids = [row[0] for row in messages]
+                for start in range(0, len(ids), SQL_VARIABLE_LIMIT):
+                    chunk = ids[start:start + SQL_VARIABLE_LIMIT]
+                    existing.update(row[0] for row in self._conn.execute(
+                        f"SELECT id FROM messages WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+                for row in messages:
+                    if row[0] not in existing:
+                        existing.add(row[0])
+                        inserted.append(row)
+                
+                # Insert first so replies to messages in this batch find their rows
+                self._conn.executemany(_INSERT_MSG_SQL, inserted)
+                for message_id in replies:
+                    if self._conn.execute(_MARK_REPLY_SQL, (message_id,)).rowcount:
+                        replied.append(self._conn.execute(_REPLIED_MSG_SQL, (message_id,)).fetchone())
         except Exception as e:
-            print(f"Error marking message as replied: {e}")
-        finally:
-            conn.close()
+            print(f"Error flushing analytics: {e}")
+            # The transaction was rolled back, so put the batch back to retry on the next flush
+            with self._pending_lock:
+                self._pending_messages[:0] = messages
+                self._pending_replies[:0] = replies
+            return
+        
+        for row in inserted:
+            self._record_rollup(row[4], row[2], row[5])
+        # Count each reply against the hour the bot message was sent in
+        for timestamp, is_bot in replied:
+            if is_bot:
+                self._mark_rollup_replied(timestamp)
+        with self._rollup_lock:
+            self._data_version += 1
     
     def update_hourly_stats(self):
         """Update hourly statistics"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            
-            # Get current hour in IST
+            # Get current hour in IST and the epoch second it starts at
             current_hour = self._format_ist_time(self._get_ist_time())
+            hour_start = self._epoch_hour(time.time()) * 3600 - IST_OFFSET_SECONDS
             
-            # Calculate stats for current hour
-            query = '''
-            SELECT 
-                CAST(COUNT(*) AS INTEGER) as total_messages,
-                CAST(COUNT(DISTINCT author_id) AS INTEGER) as unique_users,
-                CAST(SUM(CASE WHEN is_bot = 1 THEN 1 ELSE 0 END) AS INTEGER) as bot_responses,
-                CAST(AVG(CASE WHEN is_bot = 1 THEN has_reply ELSE NULL END) AS REAL) as response_rate
-            FROM messages
-            WHERE datetime(timestamp) >= datetime(?)
-            AND datetime(timestamp) < datetime(?, '+1 hour')
-            '''
-            
-            stats = pd.read_sql_query(query, conn, params=(current_hour, current_hour))
-            
-            # Update hourly stats table
-            if not stats.empty:
-                c = conn.cursor()
-                # Handle potential None values with default 0
-                total_messages = int(stats['total_messages'].iloc[0]) if pd.notnull(stats['total_messages'].iloc[0]) else 0
-                unique_users = int(stats['unique_users'].iloc[0]) if pd.notnull(stats['unique_users'].iloc[0]) else 0
-                bot_responses = int(stats['bot_responses'].iloc[0]) if pd.notnull(stats['bot_responses'].iloc[0]) else 0
-                response_rate = float(stats['response_rate'].iloc[0]) if pd.notnull(stats['response_rate'].iloc[0]) else 0.0
-                
-                c.execute('''INSERT OR REPLACE INTO hourly_stats
-                            (hour, total_messages, unique_users, bot_responses, response_rate)
-                            VALUES (?, ?, ?, ?, ?)''',
-                         (current_hour, total_messages, unique_users, bot_responses, response_rate))
+            with self._lock, self._conn:
+                unique_users, response_rate = self._conn.execute(
+                    _HOURLY_SQL, (hour_start, hour_start + 3600)).fetchone()
                 
-                conn.commit()
-            else:
-                # If no messages this hour, insert zeros
-                c = conn.cursor()
-                c.execute('''INSERT OR REPLACE INTO hourly_stats
-                            (hour, total_messages, unique_users, bot_responses, response_rate)
-                            VALUES (?, 0, 0, 0, 0.0)''', (current_hour,))
-                conn.commit()
+                # Handle potential None values with default 0
+                unique_users = unique_users or 0
+                response_rate = response_rate or 0.0
                 
+                # Update hourly stats table, inserting zero counts if no messages this hour
+                self._conn.execute(_UPSERT_HOURLY_SQL, (current_hour, unique_users, response_rate))
         except Exception as e:
             print(f"Error updating hourly stats: {e}")
-        finally:
-            conn.close()
     
     def get_hourly_stats(self, hours=24):
         """Get hourly statistics for the last n hours"""
+        # Recent windows are answered from the rollup without touching the database
+        if hours < ROLLUP_HOURS:
+            return self._rollup_stats(hours)
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            
-            # Calculate the start time for the last n hours in IST
-            start_time = (self._get_ist_time() - timedelta(hours=hours))
-            start_time_str = self._format_ist_time(start_time)
+            # IST hour numbers of the window, and the epoch second it starts at
+            current_hour = self._epoch_hour(time.time())
+            start_hour = current_hour - hours
+            start_time = start_hour * 3600 - IST_OFFSET_SECONDS
             
-            # Query to get stats directly from messages table
+            # Query stats from the messages table, joined onto a calendar of every
+            # hour in the window so quiet hours come back as zero rows
             query = '''
-            WITH hourly_data AS (
+            WITH RECURSIVE calendar(hour) AS (
+                SELECT ?
+                UNION ALL
+                SELECT hour + 1 FROM calendar WHERE hour < ?
+            ),
+            hourly_data AS (
                 SELECT 
-                    strftime('%Y-%m-%d %H:00:00', datetime(timestamp, '+5 hours', '+30 minutes')) as hour,
+                    (timestamp + ?) / 3600 as hour,
                     COUNT(*) as total_messages,
                     COUNT(DISTINCT author_id) as unique_users,
-                    SUM(CASE WHEN is_bot = 1 THEN 1 ELSE 0 END) as bot_responses,
-                    AVG(CASE WHEN is_bot = 1 THEN has_reply ELSE NULL END) as response_rate
+                    SUM(is_bot) as bot_responses,
+                    SUM(is_bot * (r.message_id IS NOT NULL)) * 1.0 / NULLIF(SUM(is_bot), 0) as response_rate
                 FROM messages
-                WHERE datetime(timestamp) >= datetime(?)
-                GROUP BY strftime('%Y-%m-%d %H:00:00', datetime(timestamp, '+5 hours', '+30 minutes'))
+                LEFT JOIN message_replies r ON r.message_id = messages.id
+                WHERE timestamp >= ?
+                GROUP BY hour
             )
             SELECT 
-                hour,
+                calendar.hour,
                 COALESCE(total_messages, 0) as total_messages,
                 COALESCE(unique_users, 0) as unique_users,
                 COALESCE(bot_responses, 0) as bot_responses,
-                COALESCE(response_rate, 0) as response_rate
-            FROM hourly_data
-            ORDER BY hour ASC
+                COALESCE(response_rate, 0.0) as response_rate
+            FROM calendar
+            LEFT JOIN hourly_data ON hourly_data.hour = calendar.hour
+            ORDER BY calendar.hour ASC
             '''
+            params = (start_hour, current_hour, IST_OFFSET_SECONDS, start_time)
             
-            stats = pd.read_sql_query(query, conn, params=(start_time_str,))
+            with self._lock:
+                if hours > STATS_CHUNKED_HOURS:
+                    # Build long windows chunk by chunk to keep peak memory flat
+                    chunks = pd.read_sql_query(query, self._conn, params=params, chunksize=STATS_CHUNKSIZE)
+                    stats = pd.concat(chunks, ignore_index=True)
+                else:
+                    stats = pd.read_sql_query(query, self._conn, params=params)
+            # read_sql_query only accepts dtype= from pandas 2.0, so apply the types afterwards
+            stats = stats.astype(_HOURLY_STATS_DTYPES)
             
-            # If no data, create a row for the current hour with zeros
-            if stats.empty:
-                current_hour = self._format_ist_time(self._get_ist_time())
-                stats = pd.DataFrame({
-                    'hour': [current_hour],
-                    'total_messages': [0],
-                    'unique_users': [0],
-                    'bot_responses': [0],
-                    'response_rate': [0]
-                })
-            
-            # Convert hour strings to datetime
-            stats['hour'] = pd.to_datetime(stats['hour'])
+            # Hour numbers already include the IST offset, so this gives IST wall-clock hours
+            stats['hour'] = pd.to_datetime(stats['hour'] * 3600, unit='s')
             return stats
             
         except Exception as e:
             print(f"Error getting hourly stats: {e}")
             return pd.DataFrame()
-        finally:
-            conn.close()
     
-    def generate_engagement_plot(self, hours=24):
-        """Generate engagement visualization"""
-        stats = self.get_hourly_stats(hours)
+    def generate_engagement_plot(self, hours=24, stats=None):
+        """Generate engagement visualization, optionally from already fetched hourly stats"""
+        # Reuse the last render if no new data has been written since
+        cache_key = (hours, self._epoch_hour(time.time()), self._data_version)
+        cached_file = self._plot_cache.get(cache_key)
+        if cached_file is not None and cached_file.exists():
+            return cached_file
+        
+        if stats is None:
+            stats = self.get_hourly_stats(hours)
         
         if stats.empty:
             return None
         
-        # Create a figure with two subplots
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 10))
-        fig.suptitle('Community Engagement Overview (Last 24 Hours - IST)', fontsize=16, y=0.95)
-        
-        # Plot 1: Message Activity
-        ax1.plot(stats['hour'], stats['total_messages'], 'b-', marker='o', label='Messages')
-        ax1.plot(stats['hour'], stats['bot_responses'], 'g-', marker='s', label='Bot Responses')
-        ax1.set_title('Hourly Message Activity', fontsize=12)
-        ax1.set_xlabel('Hour (IST)')
-        ax1.set_ylabel('Number of Messages')
-        ax1.grid(True, linestyle='--', alpha=0.7)
-        ax1.legend()
-        
-        # Format x-axis to show hours
-        ax1.xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%H:%M'))
-        ax1.xaxis.set_major_locator(plt.matplotlib.dates.HourLocator(interval=2))
-        
-        # Plot 2: User Engagement
-        ax2.plot(stats['hour'], stats['unique_users'], 'r-', marker='^', label='Active Users')
-        ax2.plot(stats['hour'], stats['response_rate'] * 100, 'm-', marker='d', label='Response Rate (%)')
-        ax2.set_title('User Engagement', fontsize=12)
-        ax2.set_xlabel('Hour (IST)')
-        ax2.set_ylabel('Count / Percentage')
-        ax2.grid(True, linestyle='--', alpha=0.7)
-        ax2.legend()
-        
-        # Format x-axis to show hours
-        ax2.xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%H:%M'))
-        ax2.xaxis.set_major_locator(plt.matplotlib.dates.HourLocator(interval=2))
-        
-        # Rotate x-axis labels for better readability
-        plt.xticks(rotation=45)
+        # Hand matplotlib plain arrays so it doesn't convert each Series itself
+        hour = stats['hour'].to_numpy(copy=False)
+        total_messages = stats['total_messages'].to_numpy(copy=False)
+        bot_responses = stats['bot_responses'].to_numpy(copy=False)
+        unique_users = stats['unique_users'].to_numpy(copy=False)
+        # A new array rather than in place, since the column may be a view of the caller's frame
+        response_rate_pct = stats['response_rate'].to_numpy(copy=False) * 100
         
-        # Adjust layout to prevent label cutoff
-        plt.tight_layout()
-        
-        # Save plot
-        plot_path = Path("engagement_plots")
-        plot_path.mkdir(exist_ok=True)
-        plt.savefig(plot_path / f"engagement_{self._get_ist_time().strftime('%Y%m%d_%H%M')}.png", 
-                   bbox_inches='tight', dpi=300)
-        plt.close()
+        with self._plot_lock:
+            ax1, ax2 = self._ax1, self._ax2
+            ax1.clear()
+            ax2.clear()
+            
+            # Plot 1: Message Activity
+            ax1.plot(hour, total_messages, 'b-', marker='o', label='Messages')
+            ax1.plot(hour, bot_responses, 'g-', marker='s', label='Bot Responses')
+            ax1.set_title('Hourly Message Activity', fontsize=12)
+            ax1.set_xlabel('Hour (IST)')
+            ax1.set_ylabel('Number of Messages')
+            ax1.grid(True, linestyle='--', alpha=0.7)
+            ax1.legend()
+            
+            # Format x-axis to show hours
+            ax1.xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%H:%M'))
+            ax1.xaxis.set_major_locator(plt.matplotlib.dates.HourLocator(interval=2))
+            
+            # Plot 2: User Engagement
+            ax2.plot(hour, unique_users, 'r-', marker='^', label='Active Users')
+            ax2.plot(hour, response_rate_pct, 'm-', marker='d', label='Response Rate (%)')
+            ax2.set_title('User Engagement', fontsize=12)
+            ax2.set_xlabel('Hour (IST)')
+            ax2.set_ylabel('Count / Percentage')
+            ax2.grid(True, linestyle='--', alpha=0.7)
+            ax2.legend()
+            
+            # Format x-axis to show hours
+            ax2.xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%H:%M'))
+            ax2.xaxis.set_major_locator(plt.matplotlib.dates.HourLocator(interval=2))
+            
+            # Rotate x-axis labels for better readability
+            ax2.tick_params(axis='x', labelrotation=45)
+            
+            # Adjust layout to prevent label cutoff
+            self._fig.tight_layout()
+            
+            # Save plot
+            plot_path = Path("engagement_plots")
+            plot_path.mkdir(exist_ok=True)
+            plot_file = plot_path / f"engagement_{self._get_ist_time().strftime('%Y%m%d_%H%M')}.png"
+            self._fig.savefig(plot_file, dpi=PLOT_DPI)
+            
+            # Only the latest render can still be current
+            self._plot_cache = {cache_key: plot_file}
         
-        return plot_path / f"engagement_{self._get_ist_time().strftime('%Y%m%d_%H%M')}.png"
+        return plot_file
     
     def get_response_effectiveness(self, hours=24):
         """Calculate bot response effectiveness"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            
             query = '''
             SELECT 
-                strftime('%Y-%m-%d %H:00:00', timestamp) as hour,
+                (timestamp + ?) / 3600 as hour,
                 CAST(COUNT(*) AS INTEGER) as total_responses,
-                CAST(SUM(has_reply) AS INTEGER) as responses_with_replies,
-                CAST(AVG(has_reply) AS REAL) as response_rate
+                CAST(SUM(r.message_id IS NOT NULL) AS INTEGER) as responses_with_replies,
+                CAST(AVG(r.message_id IS NOT NULL) AS REAL) as response_rate
             FROM messages
+            LEFT JOIN message_replies r ON r.message_id = messages.id
             WHERE is_bot = 1
-            AND timestamp >= datetime('now', ?)
-            GROUP BY strftime('%Y-%m-%d %H:00:00', timestamp)
+            AND timestamp >= ?
+            GROUP BY hour
             ORDER BY hour ASC
             '''
             
-            effectiveness = pd.read_sql_query(query, conn, params=(f'-{hours} hours',))
-            # Convert hour strings to datetime
-            effectiveness['hour'] = pd.to_datetime(effectiveness['hour'])
+            with self._lock:
+                effectiveness = pd.read_sql_query(query, self._conn, params=(IST_OFFSET_SECONDS, int(time.time()) - hours * 3600))
+            # Convert IST hour numbers to datetime
+            effectiveness['hour'] = pd.to_datetime(effectiveness['hour'] * 3600, unit='s')
             return effectiveness
         except Exception as e:
             print(f"Error getting response effectiveness: {e}")
-            return pd.DataFrame()
-        finally:
-            conn.close() 
\ No newline at end of file
+            return pd.DataFrame() 
\ No newline at end of file